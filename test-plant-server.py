@@ -8,15 +8,54 @@ Uses random walk pattern to fluctuate generation realistically within bounds.
 """
 
 import argparse
-import json
+import asyncio
+import contextlib
+import hmac
 import logging
+import math
 import random
-import threading
 import time
 from datetime import datetime, timezone
-from flask import Flask, request, jsonify
 
-app = Flask(__name__)
+import orjson
+import uvicorn
+from fastapi import FastAPI, Header, Request, Response
+from fastapi.responses import ORJSONResponse
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    """Run the random walk updater on the server's event loop"""
+    task = asyncio.create_task(update_loop(update_interval))
+    yield
+    task.cancel()
+    with contextlib.suppress(asyncio.CancelledError):
+        await task
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
+
+_log = logging.getLogger(__name__)
+
+# ISO timestamp cached per wall-clock second: [epoch_second, iso_bytes]
+_iso_cache = [0, b""]
+
+# Serialized /health body: [state_snapshot, body]
+_health_cache = [None, b""]
+
+# Full /data/latest body with fixed structure, filled by a single % substitution.
+# Timestamps are %s (pre-encoded bytes), values are %a so floats keep repr precision.
+_SOURCE = b'{"source_timestamp":"%s","status":"success","value_mw":%a}'
+_TEMPLATE = (
+    b'{"reading":{"collection_timestamp":"%s",'
+    b'"consumption":{"container_eles":' + _SOURCE + b',"container_mazp":' + _SOURCE + b'},'
+    b'"generation":{"generoso":' + _SOURCE + b',"nogueira":' + _SOURCE + b'},'
+    b'"id":%d,"plant_id":"complexo-paranhos",'
+    b'"totals":{"consumption_mw":%a,"exported_mw":%a,"generation_mw":%a},'
+    b'"trust":{"confidence_score":1.0,"status":"trusted","summary":"Test data - all checks passed"}}}'
+)
+
+def _json(obj, status=200):
+    """Serialize obj with orjson (FastAPI's ORJSONResponse)"""
+    return ORJSONResponse(obj, status_code=status)
 
 # Global state for power readings
 class PowerState:
@@ -25,157 +64,135 @@ class PowerState:
         self.gen_max = gen_max
         self.step = step
 
-        # Initialize at random starting point within range
-        self.generation_mw = random.uniform(gen_min, gen_max)
+        # Immutable (generation_mw, consumption_mw) snapshot. Generation starts
+        # at a random point within range; consumption is set via POST, default 0.
+        # All access happens on the server's event loop without awaiting
+        # mid-update, so no lock is needed; rebinding the tuple is atomic.
+        self._state = (random.uniform(gen_min, gen_max), 0.0)
 
-        # Consumption is set via POST endpoint, default to 0
-        self.consumption_mw = 0.0
+    @property
+    def generation_mw(self):
+        return self._state[0]
 
-        # Thread safety
-        self.lock = threading.Lock()
+    @property
+    def consumption_mw(self):
+        return self._state[1]
 
     def update(self):
         """Update generation using random walk pattern"""
-        with self.lock:
-            # Random walk for generation only
-            delta_gen = random.uniform(-self.step, self.step)
-            self.generation_mw += delta_gen
-            self.generation_mw = max(self.gen_min, min(self.gen_max, self.generation_mw))
-
-            logging.info(
-                f"Updated: Generation={self.generation_mw:.2f} MW, "
-                f"Consumption={self.consumption_mw:.2f} MW, "
-                f"Available={self.generation_mw - self.consumption_mw:.2f} MW"
-            )
+        # Random walk for generation only
+        gen, cons = self._state
+        gen = max(self.gen_min, min(self.gen_max, gen + random.uniform(-self.step, self.step)))
+        self._state = (gen, cons)
+
+        _log.info(
+            "Updated: Generation=%.2f MW, Consumption=%.2f MW, Available=%.2f MW",
+            gen, cons, gen - cons
+        )
 
     def set_consumption(self, consumption_mw):
         """Set consumption value from external source"""
-        with self.lock:
-            self.consumption_mw = consumption_mw
-            logging.info(f"Consumption set to {self.consumption_mw:.2f} MW")
+        self._state = (self._state[0], consumption_mw)
+        _log.info("Consumption set to %.2f MW", consumption_mw)
 
     def get_reading(self):
-        """Get current reading with realistic splitting"""
-        with self.lock:
-            now = datetime.now(timezone.utc).isoformat()
-
-            # Split generation between two sources (48-52% each, varying slightly)
-            gen_split = random.uniform(0.48, 0.52)
-            generoso_mw = self.generation_mw * gen_split
-            nogueira_mw = self.generation_mw * (1 - gen_split)
-
-            # Split consumption between two containers (45-55% each, varying slightly)
-            cons_split = random.uniform(0.45, 0.55)
-            container_eles_mw = self.consumption_mw * cons_split
-            container_mazp_mw = self.consumption_mw * (1 - cons_split)
-
-            return {
-                "reading": {
-                    "collection_timestamp": now,
-                    "consumption": {
-                        "container_eles": {
-                            "source_timestamp": now,
-                            "status": "success",
-                            "value_mw": container_eles_mw
-                        },
-                        "container_mazp": {
-                            "source_timestamp": now,
-                            "status": "success",
-                            "value_mw": container_mazp_mw
-                        }
-                    },
-                    "generation": {
-                        "generoso": {
-                            "source_timestamp": now,
-                            "status": "success",
-                            "value_mw": generoso_mw
-                        },
-                        "nogueira": {
-                            "source_timestamp": now,
-                            "status": "success",
-                            "value_mw": nogueira_mw
-                        }
-                    },
-                    "id": int(time.time()),  # Use timestamp as incrementing ID
-                    "plant_id": "complexo-paranhos",
-                    "totals": {
-                        "consumption_mw": self.consumption_mw,
-                        "exported_mw": self.generation_mw - self.consumption_mw,
-                        "generation_mw": self.generation_mw
-                    },
-                    "trust": {
-                        "confidence_score": 1.0,
-                        "status": "trusted",
-                        "summary": "Test data - all checks passed"
-                    }
-                }
-            }
+        """Get current reading, as a serialized JSON body, with realistic splitting"""
+        ts = int(time.time())
+        if ts != _iso_cache[0]:
+            _iso_cache[:] = [ts, datetime.fromtimestamp(ts, timezone.utc).isoformat().encode()]
+        now = _iso_cache[1]
+
+        # Lock-free snapshot; writers rebind the whole tuple
+        gen, cons = self._state
+
+        # Split generation between two sources (48-52% each, varying slightly)
+        generoso_mw = gen * random.uniform(0.48, 0.52)
+        nogueira_mw = gen - generoso_mw
+
+        # Split consumption between two containers (45-55% each, varying slightly)
+        container_eles_mw = cons * random.uniform(0.45, 0.55)
+        container_mazp_mw = cons - container_eles_mw
+
+        return _TEMPLATE % (
+            now,
+            now, container_eles_mw,
+            now, container_mazp_mw,
+            now, generoso_mw,
+            now, nogueira_mw,
+            ts,  # Use timestamp as incrementing ID
+            cons, gen - cons, gen
+        )
 
 # Global state instance
 state = None
 auth_token = None
+expected_auth_header = ''
+update_interval = 30
 
-@app.route('/data/latest', methods=['GET'])
-def get_latest():
+@app.get('/data/latest')
+async def get_latest(authorization: str = Header(''), plant_id: str = ''):
     """Endpoint matching the real power plant API"""
-    # Check authentication
-    auth_header = request.headers.get('Authorization', '')
-    if not auth_header.startswith('Bearer '):
-        return jsonify({"error": "Missing or invalid authorization header"}), 401
-
-    token = auth_header.replace('Bearer ', '')
-    if token != auth_token:
-        return jsonify({"error": "Invalid API token"}), 401
+    # Check authentication against the precomputed header
+    # (compare_digest only accepts ASCII str)
+    if not (authorization.isascii() and hmac.compare_digest(authorization, expected_auth_header)):
+        if not authorization.startswith('Bearer '):
+            return _json({"error": "Missing or invalid authorization header"}, 401)
+        return _json({"error": "Invalid API token"}, 401)
 
     # Check plant_id parameter
-    plant_id = request.args.get('plant_id')
     if plant_id != 'complexo-paranhos':
-        return jsonify({"error": "Invalid plant_id"}), 400
+        return _json({"error": "Invalid plant_id"}, 400)
 
-    # Return current reading
-    reading = state.get_reading()
-    return jsonify(reading)
+    # Return current reading (already serialized)
+    return Response(state.get_reading(), media_type='application/json')
 
-@app.route('/data/consumption', methods=['POST'])
-def set_consumption():
+@app.post('/data/consumption')
+async def set_consumption(request: Request):
     """Endpoint to receive expected consumption from PowerHive"""
     # No authentication required for test server
     try:
-        data = request.get_json()
+        data = await request.json()
         if not data or 'expected_consumption_mw' not in data:
-            return jsonify({"error": "Missing expected_consumption_mw field"}), 400
+            return _json({"error": "Missing expected_consumption_mw field"}, 400)
 
         consumption_mw = float(data['expected_consumption_mw'])
+        if not math.isfinite(consumption_mw):
+            return _json({"error": "Consumption must be finite"}, 400)
         if consumption_mw < 0:
-            return jsonify({"error": "Consumption must be non-negative"}), 400
+            return _json({"error": "Consumption must be non-negative"}, 400)
 
         state.set_consumption(consumption_mw)
-        return jsonify({
+        return _json({
             "status": "ok",
             "consumption_mw": round(consumption_mw, 2)
         })
     except (ValueError, TypeError) as e:
-        return jsonify({"error": f"Invalid consumption value: {str(e)}"}), 400
+        return _json({"error": f"Invalid consumption value: {str(e)}"}, 400)
 
-@app.route('/health', methods=['GET'])
-def health():
+@app.get('/health')
+async def health():
     """Health check endpoint (no auth required)"""
-    return jsonify({
-        "status": "ok",
-        "generation_range": [state.gen_min, state.gen_max],
-        "current_generation": round(state.generation_mw, 2),
-        "current_consumption": round(state.consumption_mw, 2),
-        "consumption_source": "external"  # Indicates consumption is set via POST
-    })
-
-def update_loop(interval):
-    """Background thread to update values periodically"""
+    # Payload only depends on the state snapshot, so re-serialize when it changes
+    snapshot = state._state
+    if snapshot is not _health_cache[0]:
+        gen, cons = snapshot
+        _health_cache[:] = [snapshot, orjson.dumps({
+            "status": "ok",
+            "generation_range": [state.gen_min, state.gen_max],
+            "current_generation": round(gen, 2),
+            "current_consumption": round(cons, 2),
+            "consumption_source": "external"  # Indicates consumption is set via POST
+        })]
+    return Response(_health_cache[1], media_type='application/json')
+
+async def update_loop(interval):
+    """Background task to update values periodically"""
     while True:
-        time.sleep(interval)
+        await asyncio.sleep(interval)
         state.update()
 
 def main():
-    global state, auth_token
+    global state, auth_token, expected_auth_header, update_interval
 
     parser = argparse.ArgumentParser(
         description='Test Power Plant API Server',
@@ -233,32 +250,33 @@ Consumption is set via POST /data/consumption endpoint by PowerHive automation.
         args.step
     )
     auth_token = args.token
-
-    logging.info('='*70)
-    logging.info('Test Power Plant API Server Starting')
-    logging.info('='*70)
-    logging.info(f'Generation range: {args.gen_min} - {args.gen_max} MW')
-    logging.info(f'Consumption: Set via POST /data/consumption (default: 0 MW)')
-    logging.info(f'Random walk step: ±{args.step} MW')
-    logging.info(f'Update interval: {args.interval} seconds')
-    logging.info(f'Server port: {args.port}')
-    logging.info(f'Auth token: {auth_token[:20]}...')
-    logging.info('='*70)
-    logging.info(f'Initial generation: {state.generation_mw:.2f} MW')
-    logging.info(f'Initial consumption: {state.consumption_mw:.2f} MW (awaiting POST)')
-    logging.info(f'Initial available: {state.generation_mw - state.consumption_mw:.2f} MW')
-    logging.info('='*70)
-    logging.info(f'Data endpoint: http://localhost:{args.port}/data/latest?plant_id=complexo-paranhos')
-    logging.info(f'Consumption POST: http://localhost:{args.port}/data/consumption')
-    logging.info(f'Health check: http://localhost:{args.port}/health')
-    logging.info('='*70)
-
-    # Start background update thread
-    update_thread = threading.Thread(target=update_loop, args=(args.interval,), daemon=True)
-    update_thread.start()
-
-    # Start Flask server
-    app.run(host='0.0.0.0', port=args.port, debug=False, threaded=True)
+    expected_auth_header = f'Bearer {auth_token}'
+    update_interval = args.interval
+
+    _log.info('='*70)
+    _log.info('Test Power Plant API Server Starting')
+    _log.info('='*70)
+    _log.info(f'Generation range: {args.gen_min} - {args.gen_max} MW')
+    _log.info(f'Consumption: Set via POST /data/consumption (default: 0 MW)')
+    _log.info(f'Random walk step: ±{args.step} MW')
+    _log.info(f'Update interval: {args.interval} seconds')
+    _log.info(f'Server port: {args.port}')
+    _log.info(f'Auth token: {auth_token[:20]}...')
+    _log.info('='*70)
+    _log.info(f'Initial generation: {state.generation_mw:.2f} MW')
+    _log.info(f'Initial consumption: {state.consumption_mw:.2f} MW (awaiting POST)')
+    _log.info(f'Initial available: {state.generation_mw - state.consumption_mw:.2f} MW')
+    _log.info('='*70)
+    _log.info(f'Data endpoint: http://localhost:{args.port}/data/latest?plant_id=complexo-paranhos')
+    _log.info(f'Consumption POST: http://localhost:{args.port}/data/consumption')
+    _log.info(f'Health check: http://localhost:{args.port}/health')
+    _log.info('='*70)
+
+    # Start ASGI server (update loop is started by the app lifespan).
+    # Single worker: plant state lives in process memory, so extra workers would
+    # each see a different consumption value. Keep-alive outlasts poll intervals.
+    uvicorn.run(app, host='0.0.0.0', port=args.port, loop='uvloop', http='httptools',
+                workers=1, timeout_keep_alive=30)
 
 if __name__ == '__main__':
     main()